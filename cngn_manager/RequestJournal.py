@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Any, List
+
+"""
+    RequestJournal is an append-only write-ahead journal for money-movement calls.
+    An intent record is made durable before the request is sent and an outcome
+    record is appended once the API responds. Concurrent callers share fsyncs
+    (group commit), so durability does not cost one disk flush per request.
+    After a restart, pending_intents() lists every request that has no outcome.
+    Resolved intents are dropped by compact(), which runs on close() and, when
+    max_bytes is set, whenever the file grows past it.
+    Request data is stored in plaintext; new journal files are created with mode 0o600.
+"""
+
+logger = logging.getLogger(__name__)
+
+class RequestJournal:
+    INTENT = "intent"
+    OUTCOME = "outcome"
+    FILE_MODE = 0o600
+
+    class JournalError(Exception):
+        pass
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._pending = self._load()
+        self._file = self._open_for_append(path)
+        if self._ends_with_torn_line():
+            # Start on a fresh line so new records are not glued to a partial one.
+            self._file.write("\n")
+        self._size = os.path.getsize(path)
+        self._compact_at = max_bytes
+        self._append_lock = threading.Lock()
+        self._sync_cond = threading.Condition()
+        self._written_seq = 0
+        self._durable_seq = 0
+        self._syncing = False
+        self._failure: Optional[BaseException] = None
+
+    def record_intent(self, operation: str, data: Optional[Dict[str, Any]]) -> str:
+        """
+        Durably record that a request is about to be sent. Returns the intent id.
+        Raises RequestJournal.JournalError if the record could not be made durable.
+        """
+        if self._failure is not None:
+            raise self.JournalError("Journal is unusable after an earlier failure") from self._failure
+        intent_id = uuid.uuid4().hex
+        seq = self._append({
+            "type": self.INTENT,
+            "id": intent_id,
+            "operation": operation,
+            "data": data,
+            "timestamp": time.time(),
+        })
+        self._wait_durable(seq)
+        return intent_id
+
+    def record_outcome(self, intent_id: str, response: Any, durable: bool = False) -> None:
+        """
+        Record the API response for an intent.
+        Outcomes are flushed with the next group commit unless durable=True; losing
+        one in a crash only leaves the intent listed as pending, which is safe.
+        Without durable=True this never raises, even on a failed or closed journal,
+        so a journal problem cannot hide the response of a request that was already sent.
+        """
+        if self._failure is not None:
+            if durable:
+                raise self.JournalError("Journal is unusable after an earlier failure") from self._failure
+            return
+        try:
+            seq = self._append({
+                "type": self.OUTCOME,
+                "id": intent_id,
+                "success": isinstance(response, dict) and response.get("success") is True,
+                "response": response,
+                "timestamp": time.time(),
+            })
+        except self.JournalError:
+            if durable:
+                raise
+            return
+        if durable:
+            self._wait_durable(seq)
+        if self._compact_at is not None and self._size >= self._compact_at:
+            try:
+                self.compact()
+            except self.JournalError:
+                logger.warning("Skipping journal compaction of %s", self.path, exc_info=True)
+                # Back off so a persistent problem does not cost a rewrite per outcome.
+                self._compact_at = max(self.max_bytes, 2 * self._size)
+
+    def pending_intents(self) -> List[Dict[str, Any]]:
+        """Return intent records with no matching outcome, in the order they were written."""
+        with self._append_lock:
+            return [dict(record) for record in self._pending.values()]
+
+    def flush(self) -> None:
+        """Make every record appended so far durable."""
+        with self._append_lock:
+            seq = self._written_seq
+        self._wait_durable(seq)
+
+    def compact(self) -> None:
+        """
+        Rewrite the journal with only the pending intents, then atomically replace the file.
+        Every record appended before the call is durable once it returns. If the rewrite
+        fails before the replace, the existing file is kept and JournalError is raised.
+        """
+        self._become_leader()
+        target = 0
+        try:
+            with self._append_lock:
+                if self._file.closed:
+                    raise self.JournalError("Journal is closed")
+                self._compact_locked()
+                target = self._written_seq
+        finally:
+            self._release_leader(target=target)
+
+    def close(self) -> None:
+        """
+        Compact and close the journal. Must not overlap with in-flight withdraw, swap_asset
+        or redeem_assets calls: stop issuing them first, since later intents are refused.
+        """
+        try:
+            self._become_leader()
+        except self.JournalError:
+            # The journal already failed, so no leader can still be syncing it.
+            with self._append_lock:
+                self._file.close()
+            return
+        target = 0
+        try:
+            with self._append_lock:
+                if self._file.closed:
+                    return
+                try:
+                    self._compact_locked()
+                except self.JournalError:
+                    if self._failure is not None:
+                        raise
+                    logger.warning("Skipping journal compaction of %s", self.path, exc_info=True)
+                    self._sync_locked()
+                finally:
+                    self._file.close()
+                target = self._written_seq
+        finally:
+            self._release_leader(target=target)
+
+    def __enter__(self) -> "RequestJournal":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        intents: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.path):
+            return intents
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn trailing line from a crash mid-write was never acknowledged.
+                    continue
+                self._apply(intents, record)
+        return intents
+
+    def _apply(self, intents: Dict[str, Dict[str, Any]], record: Dict[str, Any]) -> None:
+        if record.get("type") == self.INTENT:
+            intents[record["id"]] = record
+        elif record.get("type") == self.OUTCOME:
+            intents.pop(record.get("id"), None)
+
+    def _open_for_append(self, path: str, truncate: bool = False):
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else os.O_APPEND)
+        return os.fdopen(os.open(path, flags, self.FILE_MODE), "w" if truncate else "a", encoding="utf-8")
+
+    def _fsync_directory(self) -> None:
+        # Make the rename itself durable; not every platform can open a directory.
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _compact_locked(self) -> None:
+        # Callers hold sync leadership and _append_lock.
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with self._open_for_append(tmp_path, truncate=True) as tmp:
+                for record in self._pending.values():
+                    tmp.write(json.dumps(record, default=str) + "\n")
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException as e:
+            # The existing journal is untouched, so compaction is simply skipped.
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise self.JournalError("Journal compaction failed") from e
+        try:
+            self._fsync_directory()
+            self._file.close()
+            self._file = self._open_for_append(self.path)
+            self._size = os.path.getsize(self.path)
+        except BaseException as e:
+            self._failure = e
+            raise self.JournalError("Journal compaction failed after replacing the file") from e
+        if self.max_bytes is not None:
+            self._compact_at = max(self.max_bytes, 2 * self._size)
+
+    def _sync_locked(self) -> None:
+        # Callers hold sync leadership and _append_lock.
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except BaseException as e:
+            self._failure = e
+            raise self.JournalError("Journal fsync failed") from e
+
+    def _ends_with_torn_line(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def _append(self, record: Dict[str, Any]) -> int:
+        line = json.dumps(record, default=str) + "\n"
+        with self._append_lock:
+            if self._file.closed:
+                raise self.JournalError("Journal is closed")
+            self._file.write(line)
+            self._size += len(line)
+            self._apply(self._pending, record)
+            self._written_seq += 1
+            return self._written_seq
+
+    def _become_leader(self, seq: Optional[int] = None) -> bool:
+        """
+        Wait until seq is durable or this thread may sync. Returns True when this thread
+        is now the leader. With seq None, always waits for leadership.
+        """
+        with self._sync_cond:
+            while True:
+                if seq is not None and self._durable_seq >= seq:
+                    return False
+                if self._failure is not None:
+                    # A failed fsync may have dropped these pages; a later fsync can still succeed.
+                    raise self.JournalError("Journal is unusable after an earlier failure") from self._failure
+                if not self._syncing:
+                    self._syncing = True
+                    return True
+                self._sync_cond.wait()
+
+    def _release_leader(self, target: int = 0, failure: Optional[BaseException] = None) -> None:
+        with self._sync_cond:
+            self._syncing = False
+            if failure is not None:
+                self._failure = failure
+            elif self._durable_seq < target:
+                self._durable_seq = target
+            self._sync_cond.notify_all()
+
+    def _wait_durable(self, seq: int) -> None:
+        if not self._become_leader(seq):
+            return
+
+        # This thread is the leader: one fsync covers every record written so far,
+        # including those appended by followers waiting on the condition.
+        try:
+            with self._append_lock:
+                self._file.flush()
+                target = self._written_seq
+            os.fsync(self._file.fileno())
+        except BaseException as e:
+            self._release_leader(failure=e)
+            raise self.JournalError("Journal fsync failed") from e
+        self._release_leader(target=target)
@@ -15,4 +15,5 @@ cNGN HTTP Library
 from .main import CNGnManager 
 from .constants import Network, ProviderType
 from .WalletManager import WalletManager 
+from .RequestJournal import RequestJournal
 
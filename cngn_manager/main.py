@@ -8,11 +8,12 @@
 
 
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import requests
 from requests.exceptions import RequestException, HTTPError
 from .AESCrypto import AESCrypto
 from .Ed25519Crypto import Ed25519Crypto
+from .RequestJournal import RequestJournal
 
 """
     CNGnManager class is a wrapper around the CNGn API.
@@ -21,17 +22,21 @@ from .Ed25519Crypto import Ed25519Crypto
     It uses the AESCrypto and Ed25519Crypto classes to encrypt and decrypt data.
     It handles API errors and returns appropriate error messages.
     It returns JSON responses from the API.
+    An optional RequestJournal records withdraw, swap and redeem calls before they are sent.
 """
 
 class CNGnManager:
     API_URL = "https://api.cngn.co"
     API_CURRENT_VERSION = "v1"
+    # Statuses where the backend may still act on the request after replying
+    UNSETTLED_STATUS_CODES = (408, 429)
 
-    def __init__(self, api_key: str, private_key: str, encryption_key: str):
+    def __init__(self, api_key: str, private_key: str, encryption_key: str, journal: Optional[RequestJournal] = None):
         self.api_key = api_key
         self.api_url = self.API_URL
         self.private_key = private_key
         self.encryption_key = encryption_key
+        self.journal = journal
         self.client = requests.Session()
         self.client.headers.update({
             'Authorization': f'Bearer {self.api_key}',
@@ -40,19 +45,50 @@ class CNGnManager:
         })
 
     def __make_calls(self, method: str, endpoint: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        response, _ = self.__make_settled_calls(method, endpoint, data)
+        return response
+
+    def __make_settled_calls(self, method: str, endpoint: str, data: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Returns the response and whether it settles the request: True when the request was
+        never sent or a recognised API reply came back, False when the server may have received
+        it but we could not read a definite result.
+        """
         aes_crypto = AESCrypto()
         ed_crypto = Ed25519Crypto()
+        sending = False
 
         try:
             url = f'{self.api_url}/{self.API_CURRENT_VERSION}/api{endpoint}'
             request_data = self._prepare_request_data(data, aes_crypto)
+            sending = True
             response = self._send_request(method, url, request_data)
-            return self._process_response(response, ed_crypto)
+            response_data = self._process_response(response, ed_crypto)
+            return response_data, self._is_settled(response, response_data)
 
         except (RequestException, HTTPError) as e:
-            return self._handle_request_error(e)
+            return self._handle_request_error(e), not sending
         except Exception as e:
-            return self._handle_unexpected_error(e)
+            return self._handle_unexpected_error(e), not sending
+
+    def __make_journaled_calls(self, operation: str, method: str, endpoint: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if self.journal is None:
+            return self.__make_calls(method, endpoint, data)
+        intent_id = self.journal.record_intent(operation, data)
+        response, settled = self.__make_settled_calls(method, endpoint, data)
+        if settled:
+            self.journal.record_outcome(intent_id, response)
+        # Otherwise the payout may have happened: leave the intent pending for reconciliation.
+        return response
+
+    def _is_settled(self, response: requests.Response, response_data: Dict[str, Any]) -> bool:
+        # Gateways often answer 5xx with a JSON body while the backend carries on with the payout.
+        status_code = getattr(response, 'status_code', None)
+        if not isinstance(status_code, int):
+            return False
+        if status_code >= 500 or status_code in self.UNSETTLED_STATUS_CODES:
+            return False
+        return isinstance(response_data, dict) and "success" in response_data
 
     def _prepare_request_data(self, data: Optional[Dict[str, Any]], aes_crypto: AESCrypto) -> Optional[str]:
         if data is None:
@@ -95,13 +131,13 @@ class CNGnManager:
         return self.__make_calls("GET", f"/transactions?page{page}&limit={limit}")
 
     def withdraw(self, data: dict) -> str:
-        return self.__make_calls("POST", "/withdraw", data)
+        return self.__make_journaled_calls("withdraw", "POST", "/withdraw", data)
 
     def verify_withdrawal(self, tnxRef: str):
         return self.__make_calls('GET', f"/withdraw/verify/{tnxRef}")
 
     def redeem_assets(self, data: dict) -> str:
-        return self.__make_calls("POST", "/redeemAsset", data)
+        return self.__make_journaled_calls("redeem_assets", "POST", "/redeemAsset", data)
 
     def create_virtual_account(self, data: dict) -> str:
         return self.__make_calls("POST", "/createVirtualAccount", data)
@@ -113,7 +149,7 @@ class CNGnManager:
         return self.__make_calls("GET", "/banks")
     
     def swap_asset(self, data: dict) -> str:
-        return self.__make_calls("POST", "/swap", data)
+        return self.__make_journaled_calls("swap_asset", "POST", "/swap", data)
     
     def swap_quote(self, data: dict) -> str:
         return self.__make_calls("POST", "/swap-quote", data)
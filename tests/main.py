@@ -1,7 +1,11 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from cngn_manager import CNGnManager
+from cngn_manager import CNGnManager, RequestJournal
 import json
+import os
+import tempfile
+import threading
+import time
 from cngn_manager.AESCrypto import AESCrypto 
 from cngn_manager.Ed25519Crypto import Ed25519Crypto
 
@@ -127,5 +131,286 @@ class TestCNGnManager(unittest.TestCase):
         self.assertEqual(result['message'], 'Something went wrong')
         self.assertEqual(result['status_code'], 500)
 
+class TestRequestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "requests.journal")
+        self.journal = RequestJournal(self.path)
+        self.manager = CNGnManager("test_api_key", "test_private_key", "test_encryption_key", journal=self.journal)
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmpdir.cleanup()
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch.object(Ed25519Crypto, 'decrypt_with_private_key', return_value='{"reference":"ref"}')
+    @patch('requests.Session.request')
+    def test_completed_withdraw_is_not_pending(self, mock_request, mock_decrypt, mock_encrypt):
+        mock_response = MagicMock(status_code=200)
+        mock_response.json.return_value = {"success": True, "data": "encrypted_response_data"}
+        mock_request.return_value = mock_response
+
+        self.manager.withdraw({"amount": 100})
+
+        self.assertEqual(self.journal.pending_intents(), [])
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch('requests.Session.request', side_effect=RequestException("Connection reset"))
+    def test_transport_failure_stays_pending(self, mock_request, mock_encrypt):
+        self.manager.redeem_assets({"amount": 1000})
+
+        pending = self.journal.pending_intents()
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(pending[0]['operation'], 'redeem_assets')
+        self.assertEqual(pending[0]['data'], {"amount": 1000})
+
+    def test_pending_intents_after_restart(self):
+        first = self.journal.record_intent("withdraw", {"amount": 1})
+        second = self.journal.record_intent("swap_asset", {"amount": 2})
+        self.journal.record_outcome(first, {"success": True})
+        self.journal.close()
+
+        # Simulate a crash that tore the last write
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"type": "outc')
+
+        self.journal = RequestJournal(self.path)
+        third = self.journal.record_intent("withdraw", {"amount": 3})
+        pending = [record['id'] for record in self.journal.pending_intents()]
+        self.assertEqual(pending, [second, third])
+
+    def _block_first_fsync(self, error=None):
+        # Hold the first fsync until released so other threads pile up behind the leader.
+        entered = threading.Event()
+        release = threading.Event()
+        real_fsync = os.fsync
+        calls = []
+
+        def fsync(fd):
+            calls.append(fd)
+            if len(calls) == 1:
+                entered.set()
+                release.wait(5)
+                if error is not None:
+                    raise error
+            return real_fsync(fd)
+
+        return fsync, entered, release, calls
+
+    def _wait_for_pending(self, count):
+        for _ in range(500):
+            if len(self.journal.pending_intents()) >= count:
+                return
+            time.sleep(0.01)
+        self.fail(f"expected {count} pending intents")
+
+    def _intent_threads(self, count):
+        errors = []
+
+        def record(i):
+            try:
+                self.journal.record_intent("withdraw", {"amount": i})
+            except RequestJournal.JournalError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=record, args=(i,)) for i in range(count)]
+        return threads, errors
+
+    def test_concurrent_intents_share_fsyncs(self):
+        fsync, entered, release, calls = self._block_first_fsync()
+        threads, errors = self._intent_threads(50)
+        with patch('os.fsync', side_effect=fsync):
+            threads[0].start()
+            self.assertTrue(entered.wait(5))
+            for thread in threads[1:]:
+                thread.start()
+            self._wait_for_pending(50)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        # One fsync for the leader, one shared by the 49 followers queued behind it
+        self.assertEqual(len(calls), 2)
+
+    def test_failed_fsync_fails_every_waiter(self):
+        fsync, entered, release, calls = self._block_first_fsync(OSError(5, "Input/output error"))
+        threads, errors = self._intent_threads(20)
+        with patch('os.fsync', side_effect=fsync):
+            threads[0].start()
+            self.assertTrue(entered.wait(5))
+            for thread in threads[1:]:
+                thread.start()
+            self._wait_for_pending(20)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(len(errors), 20)
+            self.assertEqual(len(calls), 1)
+            with self.assertRaises(RequestJournal.JournalError):
+                self.journal.record_intent("withdraw", {"amount": 1})
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch('requests.Session.request')
+    def test_unreadable_response_stays_pending(self, mock_request, mock_encrypt):
+        mock_response = MagicMock()
+        mock_response.json.side_effect = ValueError("Expecting value")
+        mock_request.return_value = mock_response
+
+        result = self.manager.withdraw({"amount": 100})
+
+        self.assertEqual(result['success'], False)
+        self.assertEqual(len(self.journal.pending_intents()), 1)
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch.object(Ed25519Crypto, 'decrypt_with_private_key', side_effect=ValueError("Decryption failed"))
+    @patch('requests.Session.request')
+    def test_undecryptable_response_stays_pending(self, mock_request, mock_decrypt, mock_encrypt):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"success": True, "data": "encrypted_response_data"}
+        mock_request.return_value = mock_response
+
+        self.manager.swap_asset({"amount": 100})
+
+        self.assertEqual(len(self.journal.pending_intents()), 1)
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch('requests.Session.request')
+    def test_gateway_timeout_stays_pending(self, mock_request, mock_encrypt):
+        mock_response = MagicMock(status_code=504)
+        mock_response.json.return_value = {"message": "Endpoint request timed out"}
+        mock_request.return_value = mock_response
+
+        result = self.manager.withdraw({"amount": 100})
+
+        self.assertEqual(result, {"message": "Endpoint request timed out"})
+        self.assertEqual(len(self.journal.pending_intents()), 1)
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch('requests.Session.request')
+    def test_rate_limited_reply_stays_pending(self, mock_request, mock_encrypt):
+        mock_response = MagicMock(status_code=429)
+        mock_response.json.return_value = {"success": False, "message": "Too many requests"}
+        mock_request.return_value = mock_response
+
+        self.manager.redeem_assets({"amount": 100})
+
+        self.assertEqual(len(self.journal.pending_intents()), 1)
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch('requests.Session.request')
+    def test_unrecognised_reply_stays_pending(self, mock_request, mock_encrypt):
+        mock_response = MagicMock(status_code=200)
+        mock_response.json.return_value = {"message": "OK"}
+        mock_request.return_value = mock_response
+
+        self.manager.withdraw({"amount": 100})
+
+        self.assertEqual(len(self.journal.pending_intents()), 1)
+
+    @patch.object(AESCrypto, 'encrypt', return_value="encrypted_data")
+    @patch('requests.Session.request')
+    def test_rejected_withdraw_records_failure(self, mock_request, mock_encrypt):
+        mock_response = MagicMock(status_code=400)
+        mock_response.json.return_value = {"success": False, "message": "Insufficient balance"}
+        mock_request.return_value = mock_response
+
+        self.manager.withdraw({"amount": 100})
+        self.journal.flush()
+
+        self.assertEqual(self.journal.pending_intents(), [])
+        with open(self.path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[-1]['type'], RequestJournal.OUTCOME)
+        self.assertIs(records[-1]['success'], False)
+
+    @patch.object(AESCrypto, 'encrypt', side_effect=Exception("Encryption failed"))
+    @patch('requests.Session.request')
+    def test_failure_before_send_is_not_pending(self, mock_request, mock_encrypt):
+        self.manager.withdraw({"amount": 100})
+
+        mock_request.assert_not_called()
+        self.assertEqual(self.journal.pending_intents(), [])
+
+    def test_durable_outcome(self):
+        intent_id = self.journal.record_intent("withdraw", {"amount": 1})
+        with patch('os.fsync', wraps=os.fsync) as mock_fsync:
+            self.journal.record_outcome(intent_id, {"success": True}, durable=True)
+        mock_fsync.assert_called_once()
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[-1]['type'], RequestJournal.OUTCOME)
+        self.assertEqual(records[-1]['id'], intent_id)
+
+    def test_close_compacts_to_pending_intents(self):
+        resolved = self.journal.record_intent("withdraw", {"amount": 1})
+        pending = self.journal.record_intent("withdraw", {"amount": 2})
+        self.journal.record_outcome(resolved, {"success": True})
+        self.journal.close()
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record['id'] for record in records], [pending])
+
+    def test_compacts_past_max_bytes(self):
+        self.journal.close()
+        self.journal = RequestJournal(self.path, max_bytes=4096)
+        for i in range(200):
+            intent_id = self.journal.record_intent("withdraw", {"amount": i})
+            self.journal.record_outcome(intent_id, {"success": True})
+
+        self.assertLess(os.path.getsize(self.path), 4096 * 2)
+        self.assertEqual(self.journal.pending_intents(), [])
+
+    def test_failed_compaction_keeps_journal_usable(self):
+        resolved = self.journal.record_intent("withdraw", {"amount": 1})
+        pending = self.journal.record_intent("withdraw", {"amount": 2})
+        self.journal.record_outcome(resolved, {"success": True})
+
+        with patch('os.replace', side_effect=OSError(28, "No space left on device")):
+            with self.assertRaises(RequestJournal.JournalError):
+                self.journal.compact()
+
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+        self.journal.record_intent("withdraw", {"amount": 3})
+        self.assertEqual(len(self.journal.pending_intents()), 2)
+
+        with patch('os.replace', side_effect=OSError(28, "No space left on device")):
+            with self.assertLogs('cngn_manager.RequestJournal', level='WARNING'):
+                self.journal.close()
+
+        reopened = RequestJournal(self.path)
+        self.assertEqual([record['id'] for record in reopened.pending_intents()][0], pending)
+        self.assertEqual(len(reopened.pending_intents()), 2)
+        reopened.close()
+
+    def test_failed_auto_compaction_is_logged(self):
+        self.journal.close()
+        self.journal = RequestJournal(self.path, max_bytes=1)
+        intent_id = self.journal.record_intent("withdraw", {"amount": 1})
+
+        with patch('os.replace', side_effect=OSError(28, "No space left on device")):
+            with self.assertLogs('cngn_manager.RequestJournal', level='WARNING'):
+                self.journal.record_outcome(intent_id, {"success": True})
+
+        self.assertEqual(self.journal.pending_intents(), [])
+        self.journal.record_intent("withdraw", {"amount": 2})
+
+    def test_record_after_close(self):
+        intent_id = self.journal.record_intent("withdraw", {"amount": 1})
+        self.journal.close()
+
+        self.journal.record_outcome(intent_id, {"success": True})
+        with self.assertRaises(RequestJournal.JournalError):
+            self.journal.record_outcome(intent_id, {"success": True}, durable=True)
+        with self.assertRaises(RequestJournal.JournalError):
+            self.journal.record_intent("withdraw", {"amount": 2})
+
+    def test_journal_file_is_private(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, RequestJournal.FILE_MODE)
+
 if __name__ == '__main__':
     unittest.main()